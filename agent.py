@@ -7,113 +7,502 @@
 # ------------------------------------------------------------------------------
 import os
 import time
+import asyncio
 import logging
-import tempfile
-import hashlib
 import json
-import redis
+import functools
+import threading
+import concurrent.futures
+import mimetypes
+from datetime import datetime, timedelta
+import httpx
+import redis.asyncio as aioredis
 from google import genai
 from google.genai import types
 from config import Settings
-from utils import download_to_temp, download_blob, save_video_bytes, update_job_status, stitch_videos, get_job_from_db
+from utils import download_to_temp, download_blob, save_video_bytes, new_temp_path, update_job_status, stitch_videos, normalize_video, get_job_from_db, FFMPEG_EXECUTOR
 from billing import refund_credits_by_job_id, reserve_credits, settle_transaction
+from resilience import aretry_call, poll_until, is_retryable, RETRY_ATTEMPTS, CircuitOpenError, ProviderDisabledError
+from cache import JsonCache, hash_file, hash_key
+from schemas import DirectorAnalysis
+from pydantic import ValidationError
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_file_hash(filepath):
-    hash_md5 = hashlib.md5()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+# Hard ceilings (seconds) so a stuck provider call can never pin a worker indefinitely.
+HTTP_TIMEOUT = 120
+UPLOAD_TIMEOUT = 300
+PROCESSING_TIMEOUT = Settings.FILE_UPLOAD_TIMEOUT
+GENERATE_TIMEOUT = 180
+STREAM_IDLE_TIMEOUT = 45
+VEO_TIMEOUT = 600
+
+# Invariant instructions go first in `contents` so Gemini's implicit prefix caching can reuse them.
+DIRECTOR_PROMPT = """
+You are a VFX Director. Analyze Video A and Video C.
+Return a JSON object with exactly these keys:
+{
+    "analysis_a": "Brief description of Video A",
+    "analysis_c": "Brief description of Video C",
+    "visual_prompt_b": "A surreal, seamless morphing prompt that transforms A into C."
+}
+"""
+
+# Tried in order; a rate-limited or tripped model falls through to the next instead of waiting out backoff.
+DIRECTOR_MODELS = ("gemini-2.0-flash", "gemini-2.0-flash-lite")
+
+# Bump when DIRECTOR_PROMPT changes so stale cached prompts are not reused.
+DIRECTOR_PROMPT_VERSION = 2
+prompt_cache = JsonCache("prompts", ttl=Settings.PROMPT_CACHE_TTL)
+
+# Gemini caps a whole request at 20 MB; inline parts travel base64-encoded (4/3 of raw size).
+INLINE_REQUEST_LIMIT = 20 * 1000 * 1000
+INLINE_REQUEST_OVERHEAD = 64 * 1024  # JSON envelope, config and schema
+
+
+def inline_request_size(*paths):
+    """Wire size of a Director request carrying `paths` inline, estimated from the base64 expansion."""
+    encoded = sum(-(-os.path.getsize(p) // 3) * 4 for p in paths)
+    return encoded + len(DIRECTOR_PROMPT.encode()) + INLINE_REQUEST_OVERHEAD
+
+
+# Keep-alive pool shared by every request a cached client makes (uploads, polls, generate).
+HTTP_POOL_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0)
+
+
+def _http_options(timeout_s):
+    pool = {"limits": HTTP_POOL_LIMITS}
+    return types.HttpOptions(timeout=timeout_s * 1000, client_args=pool, async_client_args=pool)
+
+
+@functools.lru_cache(maxsize=None)
+def _gemini_client():
+    """Process-wide Gemini Developer API client; reuses its HTTP connection pool across jobs."""
+    return genai.Client(api_key=Settings.GOOGLE_API_KEY, http_options=_http_options(UPLOAD_TIMEOUT))
+
+
+@functools.lru_cache(maxsize=None)
+def _vertex_client():
+    """Process-wide Vertex AI client used for Veo generation."""
+    return genai.Client(
+        vertexai=True, project=Settings.GCP_PROJECT_ID, location=Settings.GCP_LOCATION,
+        http_options=_http_options(HTTP_TIMEOUT)
+    )
+
+
+# Gemini deletes uploaded files after 48h; a handle stops being reused an hour before that.
+FILE_RETENTION = 48 * 3600
+UPLOAD_EXPIRY_MARGIN = 3600
+UPLOAD_HANDLE_TTL = FILE_RETENTION - UPLOAD_EXPIRY_MARGIN
+# content hash -> (expires_at wall-clock seconds, File)
+_upload_handles = {}
+# Survives restarts: content hash -> {"name": "files/..."}, written once per fresh upload.
+upload_index = JsonCache("uploads", ttl=UPLOAD_HANDLE_TTL)
+
+
+def _upload_expiry(f):
+    """When f's handle must stop being reused: its own expiration_time (or create_time + 48h)
+    less the margin; a full UPLOAD_HANDLE_TTL from now if the File reports neither."""
+    expires = getattr(f, "expiration_time", None)
+    if not isinstance(expires, datetime):
+        created = getattr(f, "create_time", None)
+        expires = created + timedelta(seconds=FILE_RETENTION) if isinstance(created, datetime) else None
+    if expires is None:
+        return time.time() + UPLOAD_HANDLE_TTL
+    return expires.timestamp() - UPLOAD_EXPIRY_MARGIN
+
+
+def _remember_upload(file_hash, f, expires_at):
+    now = time.time()
+    for key, (expiry, _) in list(_upload_handles.items()):
+        if expiry <= now:
+            _upload_handles.pop(key, None)
+    _upload_handles[file_hash] = (expires_at, f)
+    return f
+
+
+class RemoteFileIndex:
+    """display_name -> File snapshot of the Gemini Files API, refreshed at most every `ttl` seconds.
+
+    Concurrent callers share a single files.list walk.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._files = {}
+        self._fetched_at = None
+        self._refresh = None
+
+    def clear(self):
+        with self._lock:
+            self._files, self._fetched_at = {}, None
+
+    async def snapshot(self, client):
+        with self._lock:
+            if self._fetched_at is not None and time.monotonic() - self._fetched_at <= self.ttl:
+                return self._files
+            shared = self._refresh
+            leader = shared is None
+            if leader:
+                shared = self._refresh = concurrent.futures.Future()
+
+        if not leader:
+            return await asyncio.wrap_future(shared)
+        try:
+            files = {}
+            async for f in await client.aio.files.list(config={"page_size": 100}):
+                if f.display_name:
+                    files[f.display_name] = f
+            with self._lock:
+                self._files, self._fetched_at = files, time.monotonic()
+            shared.set_result(files)
+            return files
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._refresh = None
+
 
+remote_files = RemoteFileIndex(ttl=60)
+
+
+async def get_or_upload_file(client, filepath, file_hash=None):
+    """Returns an uploaded Gemini File for filepath, deduped by content hash (display_name)."""
+    file_hash = file_hash or await asyncio.to_thread(hash_file, filepath)
+    entry = _upload_handles.get(file_hash)
+    if entry and time.time() < entry[0]:
+        logger.info("♻️ Upload Handle Hit: %s", file_hash)
+        return entry[1]
+
+    # Existing uploads may be nearly 48h old; only reuse ones with time left before deletion.
+    indexed = await asyncio.to_thread(upload_index.get, file_hash)
+    if indexed:
+        try:
+            f = await client.aio.files.get(name=indexed["name"])
+            expires_at = _upload_expiry(f)
+            if f.state.name in ("ACTIVE", "PROCESSING") and time.time() < expires_at:
+                logger.info("♻️ Upload Index Hit: %s", file_hash)
+                return _remember_upload(file_hash, f, expires_at)
+        except Exception:
+            pass
 
-def get_or_upload_file(client, filepath):
-    file_hash = get_file_hash(filepath)
     try:
-        for f in client.files.list(config={"page_size": 50}):
-            if f.display_name == file_hash and f.state.name == "ACTIVE":
-                logger.info(f"♻️ Smart Cache Hit: {file_hash}")
-                return f
+        f = (await remote_files.snapshot(client)).get(file_hash)
+        if f and f.state.name == "ACTIVE":
+            expires_at = _upload_expiry(f)
+            if time.time() < expires_at:
+                logger.info("♻️ Smart Cache Hit: %s", file_hash)
+                return _remember_upload(file_hash, f, expires_at)
     except Exception:
         pass
-    logger.info(f"⬆️ Uploading new file: {file_hash}")
-    return client.files.upload(file=filepath, config={"display_name": file_hash})
+    logger.info("⬆️ Uploading new file: %s", file_hash)
+    f = await client.aio.files.upload(file=filepath, config={"display_name": file_hash})
+    await asyncio.to_thread(upload_index.set, file_hash, {"name": f.name})
+    return _remember_upload(file_hash, f, _upload_expiry(f))
 
 
-def analyze_only(path_a, path_c, job_id=None):
-    update_job_status(job_id, "analyzing", 10, "Director checking file cache...")
-    client = genai.Client(api_key=Settings.GOOGLE_API_KEY)
+async def wait_active(client, f):
+    """Polls a Gemini file until it leaves the PROCESSING state.
 
-    try:
-        file_a = get_or_upload_file(client, path_a)
-        file_c = get_or_upload_file(client, path_c)
-
-        while file_a.state.name == "PROCESSING" or file_c.state.name == "PROCESSING":
-            update_job_status(job_id, "analyzing", 20, "Google processing video...")
-            time.sleep(2)
-            file_a = client.files.get(name=file_a.name)
-            file_c = client.files.get(name=file_c.name)
-
-        prompt = """
-        You are a VFX Director. Analyze Video A and Video C.
-        Return a JSON object with exactly these keys:
-        {
-            "analysis_a": "Brief description of Video A",
-            "analysis_c": "Brief description of Video C",
-            "visual_prompt_b": "A surreal, seamless morphing prompt that transforms A into C."
-        }
-        """
-        update_job_status(job_id, "analyzing", 30, "Director drafting creative morph...")
-
-        res = client.models.generate_content(
-            model="gemini-2.0-flash", 
-            contents=[prompt, file_a, file_c],
-            config=types.GenerateContentConfig(response_mime_type="application/json")
-        )
-        
-        text = res.text.strip()
-        if text.startswith("```json"): text = text[7:]
-        elif text.startswith("```"): text = text[3:]
-        if text.endswith("```"): text = text[:-3]
-        text = text.strip()
-        
-        data = {}
+    The first get is immediate (short clips are often ACTIVE by then); later polls back off 0.5s -> 10s, jittered.
+    """
+    return await poll_until(
+        lambda: client.aio.files.get(name=f.name),
+        lambda current: current.state.name != "PROCESSING",
+        delay=0.5, cap=10.0, timeout=PROCESSING_TIMEOUT
+    )
+
+
+def inline_video_part(filepath):
+    with open(filepath, "rb") as f:
+        data = f.read()
+    return types.Part.from_bytes(data=data, mime_type=mimetypes.guess_type(filepath)[0] or "video/mp4")
+
+
+async def fetch_inputs(*sources):
+    """Fetches any http(s)/gs:// sources concurrently; local paths and file:// URIs resolve without a copy."""
+    async def fetch(src):
+        if isinstance(src, str) and src.startswith(("http://", "https://", "gs://")):
+            return await asyncio.to_thread(download_to_temp, src)
+        if isinstance(src, os.PathLike) or (isinstance(src, str) and src.startswith("file://")):
+            return download_to_temp(src)
+        return src
+    return await asyncio.gather(*(fetch(src) for src in sources))
+
+
+async def collect_stream(stream, idle_timeout=STREAM_IDLE_TIMEOUT, on_chunk=None):
+    """Joins streamed chunk text; fails if no chunk arrives within idle_timeout seconds.
+
+    on_chunk(received_chars) is awaited after each non-empty chunk.
+    """
+    chunks = []
+    received = 0
+    iterator = (await stream).__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(iterator.__anext__(), idle_timeout)
+        except StopAsyncIteration:
+            break
+        if chunk.text:
+            chunks.append(chunk.text)
+            received += len(chunk.text)
+            if on_chunk: await on_chunk(received)
+    return "".join(chunks)
+
+
+def salvage_json(text):
+    """Best-effort parse of a truncated JSON object: closes an open string and any open brackets.
+
+    Returns only the top-level string fields that survived; {} if nothing is recoverable.
+    """
+    closers = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            if escaped: escaped = False
+            elif ch == "\\": escaped = True
+            elif ch == '"': in_string = False
+        elif ch == '"': in_string = True
+        elif ch in "{[": closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers: closers.pop()
+
+    repaired = text[:-1] if escaped else text
+    if in_string: repaired += '"'
+    repaired = repaired.rstrip().rstrip(",:")
+    # A dangling key (`"visual_prompt_b"`) has no value to keep; drop it with its separator.
+    for _ in range(2):
         try:
-            parsed = json.loads(text)
-            if isinstance(parsed, list): data = parsed[0] if len(parsed) > 0 else {}
-            elif isinstance(parsed, dict): data = parsed
+            parsed = json.loads(repaired + "".join(reversed(closers)))
+            break
         except json.JSONDecodeError:
-            logger.warning(f"JSON Parse Failed. Fallback to raw text.")
-            pass
+            cut = max(repaired.rfind(","), repaired.rfind("{"))
+            if cut < 0: return {}
+            repaired = repaired[:cut + 1].rstrip(",") if repaired[cut] == "{" else repaired[:cut]
+    else:
+        return {}
+    if not isinstance(parsed, dict): return {}
+    return {k: v for k, v in parsed.items() if isinstance(v, str) and v}
+
+
+def throttled_progress(job_id, status, progress, message, interval=1.0):
+    """Returns an async on_chunk callback posting `message` (formatted with the char count) at most every `interval` s."""
+    last = [0.0]
+
+    async def report(received):
+        now = time.monotonic()
+        if now - last[0] >= interval:
+            last[0] = now
+            await asyncio.to_thread(update_job_status, job_id, status, progress, message.format(received))
+    return report
+
+
+# Analyses currently running, keyed by prompt cache key; identical requests await the first one's future.
+# Callers must all run on the process's one event loop: the cached genai clients' async HTTP pool is bound to it.
+_inflight_analyses = {}
+_inflight_lock = threading.Lock()
+
 
-        return {
-            "analysis_a": data.get("analysis_a", "Analysis unavailable."),
-            "analysis_c": data.get("analysis_c", "Analysis unavailable."),
-            "prompt": data.get("visual_prompt_b", text), 
-            "status": "success"
-        }
+async def analyze_only_async(path_a, path_c, job_id=None):
+    await asyncio.to_thread(update_job_status, job_id, "analyzing", 10, "Director checking file cache...")
 
+    try:
+        path_a, path_c = await fetch_inputs(path_a, path_c)
+
+        hash_a, hash_c = await asyncio.gather(asyncio.to_thread(hash_file, path_a), asyncio.to_thread(hash_file, path_c))
+        cache_key = hash_key(DIRECTOR_PROMPT_VERSION, hash_a, hash_c)
+        cached = await asyncio.to_thread(prompt_cache.get, cache_key)
+        if cached:
+            logger.info("♻️ Director Cache Hit: %s", cache_key)
+            return {**cached, "status": "success"}
+
+        # Single-flight: identical concurrent requests wait on the first one's result.
+        with _inflight_lock:
+            shared = _inflight_analyses.get(cache_key)
+            leader = shared is None
+            if leader:
+                shared = _inflight_analyses[cache_key] = concurrent.futures.Future()
+
+        if not leader:
+            logger.info("Joining in-flight analysis: %s", cache_key)
+            result = await asyncio.wrap_future(shared)
+        else:
+            try:
+                result = await direct_transition(path_a, path_c, cache_key, job_id, file_hashes=(hash_a, hash_c))
+                shared.set_result(result)
+            except BaseException as e:
+                shared.set_exception(e)
+                raise
+            finally:
+                with _inflight_lock:
+                    _inflight_analyses.pop(cache_key, None)
+        return {**result, "status": "success"}
+
+    except ProviderDisabledError as e:
+        return {"detail": f"Director unavailable: {e}", "status": "error"}
+    except CircuitOpenError as e:
+        logger.warning("Analysis skipped: %s", e)
+        return {"detail": "Director temporarily unavailable (provider quota exhausted). Please retry shortly.", "status": "error"}
     except Exception as e:
-        logger.error(f"Analysis failed: {e}")
-        return {"detail": str(e), "status": "error"}
+        logger.error("Analysis failed: %r", e)
+        return {"detail": str(e) or type(e).__name__, "status": "error"}
+
+
+async def run_director(client, contents, job_id=None):
+    """Streams the Director response, falling down DIRECTOR_MODELS when a model is rate-limited,
+    times out or has an open circuit. Only the last model gets the full retry budget.
+
+    Returns (text, model that answered)."""
+    for i, model in enumerate(DIRECTOR_MODELS):
+        last = i == len(DIRECTOR_MODELS) - 1
+        try:
+            # Streamed so long responses keep the connection active (no 100s gateway 524s).
+            text = await aretry_call(
+                lambda: asyncio.wait_for(
+                    collect_stream(client.aio.models.generate_content_stream(
+                        model=model,
+                        contents=contents,
+                        config=types.GenerateContentConfig(
+                            response_mime_type="application/json",
+                            response_schema=DirectorAnalysis,
+                            http_options=types.HttpOptions(timeout=STREAM_IDLE_TIMEOUT * 1000)
+                        )
+                    ), on_chunk=throttled_progress(job_id, "analyzing", 35, "Director writing ({} chars)...")),
+                    GENERATE_TIMEOUT
+                ),
+                attempts=RETRY_ATTEMPTS if last else 1,
+                on_retry=lambda e, wait: update_job_status(job_id, "analyzing", 30, f"Director rate-limited. Retrying in {wait:.0f}s..."),
+                circuit=f"gemini-generate:{model}"
+            )
+            return text, model
+        except ProviderDisabledError:
+            raise
+        except Exception as e:
+            if last or not (isinstance(e, CircuitOpenError) or is_retryable(e)):
+                raise
+            logger.warning("Director model %s unavailable (%s); falling back to %s.", model, e, DIRECTOR_MODELS[i + 1])
+            await asyncio.to_thread(update_job_status, job_id, "analyzing", 30, "Director busy. Switching to backup model...")
+
+
+async def direct_transition(path_a, path_c, cache_key, job_id=None, file_hashes=(None, None)):
+    """Runs the Gemini Director over both clips and caches a successfully parsed result."""
+    client = _gemini_client()
 
+    # Small pairs go inline, skipping the Files API round trips; about 14 MB of raw video fits.
+    if inline_request_size(path_a, path_c) <= INLINE_REQUEST_LIMIT:
+        file_a, file_c = await asyncio.gather(
+            asyncio.to_thread(inline_video_part, path_a),
+            asyncio.to_thread(inline_video_part, path_c)
+        )
+    else:
+        # Both files upload and activate concurrently; wall time is max(a, c).
+        upload = lambda path, file_hash: asyncio.wait_for(get_or_upload_file(client, path, file_hash), UPLOAD_TIMEOUT)
+        file_a, file_c = await asyncio.gather(
+            aretry_call(lambda: upload(path_a, file_hashes[0]), circuit="gemini-files"),
+            aretry_call(lambda: upload(path_c, file_hashes[1]), circuit="gemini-files")
+        )
+
+        if file_a.state.name == "PROCESSING" or file_c.state.name == "PROCESSING":
+            await asyncio.to_thread(update_job_status, job_id, "analyzing", 20, "Google processing video...")
+            # wait_active is bounded by PROCESSING_TIMEOUT itself
+            file_a, file_c = await asyncio.gather(wait_active(client, file_a), wait_active(client, file_c))
+
+    await asyncio.to_thread(update_job_status, job_id, "analyzing", 30, "Director drafting creative morph...")
+
+    raw_text, model = await run_director(client, [DIRECTOR_PROMPT, file_a, file_c], job_id)
+
+    # response_schema makes Gemini emit bare JSON; only a truncated stream fails validation.
+    text = raw_text.strip()
+    complete = True
+    try:
+        data = DirectorAnalysis.model_validate_json(text).model_dump()
+    except ValidationError:
+        complete = False
+        data = salvage_json(text)
+        logger.warning("JSON Parse Failed. Salvaged keys: %s", sorted(data) or "none")
+
+    result = {
+        "analysis_a": data.get("analysis_a") or "Analysis unavailable.",
+        "analysis_c": data.get("analysis_c") or "Analysis unavailable.",
+        "prompt": data.get("visual_prompt_b") or text
+    }
+    # Fallback-model answers are served but not cached, so one busy moment doesn't pin them for the TTL.
+    if complete and data.get("visual_prompt_b") and model == DIRECTOR_MODELS[0]:
+        await asyncio.to_thread(prompt_cache.set, cache_key, result)
+    return result
+
+
+# In-flight Veo pollers keyed by operation name; concurrent waiters share one poll stream.
+_operation_pollers = {}
+
+
+async def _poll_operation(client, op_name, timeout):
+    polling_op = types.GenerateVideosOperation(name=op_name)
+
+    async def fetch():
+        try:
+            return await aretry_call(lambda: client.aio.operations.get(polling_op))
+        except Exception as e:
+            logger.warning("Polling error: %s", e)
+            return None
 
-def generate_only(prompt, path_a, path_c, job_id, style, audio, neg, guidance, motion, user_id):
+    try:
+        op = await poll_until(fetch, lambda op: getattr(op, "done", False), delay=2.0, cap=30.0, timeout=timeout)
+    except TimeoutError:
+        raise TimeoutError(f"Veo generation exceeded {timeout // 60}m.") from None
+    logger.info("Generation Done.")
+    return op
+
+
+async def wait_for_operation(client, op_name, timeout=VEO_TIMEOUT):
+    """Waits for a Veo operation with growing backoff; callers on the same op share one poller."""
+    task = _operation_pollers.get(op_name)
+    if task is None:
+        task = asyncio.ensure_future(_poll_operation(client, op_name, timeout))
+        _operation_pollers[op_name] = task
+        task.add_done_callback(lambda _: _operation_pollers.pop(op_name, None))
+    return await asyncio.shield(task)
+
+
+def first_generated_video(op):
+    """First video of a finished Veo operation, whether the SDK hands back an object or a dict; None if empty."""
+    result = op.result() if callable(op.result) else op.result
+    if isinstance(result, dict):
+        videos = result.get("generated_videos")
+    else:
+        videos = getattr(result, "generated_videos", None)
+    return videos[0] if videos else None
+
+
+async def run_ffmpeg_work(fn, *args, **kwargs):
+    """Runs blocking ffmpeg work on FFMPEG_EXECUTOR, keeping the default to_thread pool free."""
+    return await asyncio.get_running_loop().run_in_executor(FFMPEG_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+
+async def prepare_stitch_inputs(*paths):
+    """Normalizes stitch inputs ahead of time; inputs that fail are left for stitch_videos to redo."""
+    results = await asyncio.gather(*(run_ffmpeg_work(normalize_video, p) for p in paths), return_exceptions=True)
+    return {p: r for p, r in zip(paths, results) if isinstance(r, str)}
+
+
+async def generate_only_async(prompt, path_a, path_c, job_id, style, audio, neg, guidance, motion, user_id):
+    stitch_prep = None
     try:
         # Reserve Credits inside the worker
         try:
-            reserve_credits(user_id, Settings.COST_PER_JOB, job_id)
+            await asyncio.to_thread(reserve_credits, user_id, Settings.COST_PER_JOB, job_id)
         except ValueError as e:
-            update_job_status(job_id, "error", 0, f"Insufficient funds: {e}")
+            await asyncio.to_thread(update_job_status, job_id, "error", 0, f"Insufficient funds: {e}")
             return
         except Exception as e:
-            update_job_status(job_id, "error", 0, "Transaction failed.")
+            await asyncio.to_thread(update_job_status, job_id, "error", 0, "Transaction failed.")
             return
 
-        update_job_status(job_id, "generating", 50, "Production started (Veo 3.1)...")
+        await asyncio.to_thread(update_job_status, job_id, "generating", 50, "Production started (Veo 3.1)...")
         full_prompt = f"{style} style. {prompt} Soundtrack: {audio}"
         if neg:
             full_prompt += f" --no {neg}"
@@ -121,110 +510,108 @@ def generate_only(prompt, path_a, path_c, job_id, style, audio, neg, guidance, m
         if not Settings.GCP_PROJECT_ID:
             raise Exception("GCP_PROJECT_ID missing.")
             
-        client = genai.Client(vertexai=True, project=Settings.GCP_PROJECT_ID, location=Settings.GCP_LOCATION)
-        
+        client = _vertex_client()
+
+        # A and C don't depend on Veo's output, so normalize them while the bridge renders.
+        stitch_prep = asyncio.ensure_future(prepare_stitch_inputs(path_a, path_c))
+
         # 1. Start Job
-        op = client.models.generate_videos(
-            model="veo-3.1-generate-preview",
-            prompt=full_prompt, 
-            config=types.GenerateVideosConfig(number_of_videos=1)
+        op = await aretry_call(
+            lambda: client.aio.models.generate_videos(
+                model="veo-3.1-generate-preview",
+                prompt=full_prompt,
+                config=types.GenerateVideosConfig(number_of_videos=1)
+            ),
+            on_retry=lambda e, wait: update_job_status(job_id, "generating", 50, f"Veo rate-limited. Retrying in {wait:.0f}s..."),
+            circuit="veo",
+            idempotent=False  # a timed-out start may already be rendering (and billed)
         )
         
         # 2. Extract ID String
         op_name = op.name if hasattr(op, "name") else str(op)
-        logger.info(f"Polling Job ID: {op_name}")
-        
-        # 3. Create Valid SDK Object for Polling
-        polling_op = types.GenerateVideosOperation(name=op_name)
+        logger.info("Polling Job ID: %s", op_name)
 
-        start_time = time.time()
-        while True:
-            if time.time() - start_time > 600:
-                raise Exception("Timeout (10m).")
-            
-            try:
-                # Refresh logic: Pass the valid types.GenerateVideosOperation object
-                refreshed_op = client.operations.get(polling_op)
-                
-                # Check status
-                if hasattr(refreshed_op, "done") and refreshed_op.done:
-                    logger.info("Generation Done.")
-                    op = refreshed_op 
-                    break
-                    
-            except Exception as e:
-                logger.warning(f"Polling error: {e}")
-                time.sleep(20)
-                continue
-            
-            logger.info("Waiting for Veo...")
-            time.sleep(20)
+        # 3. Poll with growing backoff (2s -> 30s, jittered) until done or VEO_TIMEOUT
+        op = await wait_for_operation(client, op_name)
 
         # 4. Result Extraction
-        res_val = op.result
-        result = res_val() if callable(res_val) else res_val
-        
-        if result and (getattr(result, "generated_videos", None) or "generated_videos" in result):
-            vid = result.generated_videos[0] if hasattr(result, "generated_videos") else result["generated_videos"][0]
-            bridge_path = tempfile.mktemp(suffix=".mp4")
-            
+        vid = first_generated_video(op)
+        if vid:
             if hasattr(vid.video, "uri") and vid.video.uri:
-                download_blob(vid.video.uri, bridge_path)
+                bridge_path = new_temp_path(".mp4")
+                await asyncio.to_thread(download_blob, vid.video.uri, bridge_path)
             else:
-                bridge_path = save_video_bytes(vid.video.video_bytes)
+                bridge_path = await asyncio.to_thread(save_video_bytes, vid.video.video_bytes)
+                # op keeps the response alive until the job ends; drop the in-memory MP4 before stitching
+                vid.video.video_bytes = None
             
-            update_job_status(job_id, "stitching", 85, "Stitching...")
+            await asyncio.to_thread(update_job_status, job_id, "stitching", 85, "Stitching...")
             final_cut = os.path.join("outputs", f"{job_id}_merged_temp.mp4")
-            merged_path = stitch_videos(path_a, bridge_path, path_c, final_cut)
+            merged_path = await run_ffmpeg_work(
+                stitch_videos, path_a, bridge_path, path_c, final_cut, normalized=await stitch_prep
+            )
             
             msg = "Done! (Merged)" if merged_path else "Done! (Bridge Only)"
-            update_job_status(job_id, "completed", 100, msg, video_url=bridge_path, merged_video_url=merged_path)
-            settle_transaction(job_id)
+            # Moves outputs and uploads to GCS, so keep it off the loop shared with other jobs
+            await asyncio.to_thread(update_job_status, job_id, "completed", 100, msg, video_url=bridge_path, merged_video_url=merged_path)
+            await asyncio.to_thread(settle_transaction, job_id)
         else:
             raise Exception("No video output.")
 
     except Exception as e:
         logger.error(f"Worker crashed: {e}")
-        update_job_status(job_id, "error", 0, f"Error: {e}")
-        refund_credits_by_job_id(job_id, Settings.COST_PER_JOB)
+        await asyncio.to_thread(update_job_status, job_id, "error", 0, f"Error: {e}")
+        await asyncio.to_thread(refund_credits_by_job_id, job_id, Settings.COST_PER_JOB)
 
     finally:
+        # Drop any pre-normalized inputs the stitch did not consume
+        if stitch_prep is not None:
+            try:
+                for norm_path in (await stitch_prep).values():
+                    if os.path.exists(norm_path): os.remove(norm_path)
+            except Exception as e:
+                logger.warning("Stitch prep cleanup failed: %s", e)
+
         # Enforce Terminal State
         try:
-            job = get_job_from_db(job_id)
+            job = await asyncio.to_thread(get_job_from_db, job_id)
             if job:
                 status = job.get("status")
                 if status not in ["completed", "error"]:
                     logger.warning(f"Job {job_id} left in non-terminal state ({status}). Forcing error.")
-                    update_job_status(job_id, "error", 0, "Job terminated unexpectedly.")
-                    refund_credits_by_job_id(job_id, Settings.COST_PER_JOB)
+                    await asyncio.to_thread(update_job_status, job_id, "error", 0, "Job terminated unexpectedly.")
+                    await asyncio.to_thread(refund_credits_by_job_id, job_id, Settings.COST_PER_JOB)
         except Exception as e:
             logger.error(f"Final safety net failed: {e}")
 
 def run_worker():
+    asyncio.run(run_worker_async())
+
+
+async def run_worker_async():
+    """Pulls jobs from Redis and runs up to Settings.WORKER_CONCURRENCY of them concurrently on one loop."""
     logger.info("Worker started. Connecting to Redis...")
-    redis_client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+    redis_client = aioredis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+    slots = asyncio.Semaphore(Settings.WORKER_CONCURRENCY)
+    running = set()
 
     while True:
+        # Claim a slot before popping so jobs we can't start yet stay queued for other workers.
+        await slots.acquire()
+        started = False
         try:
             logger.info("Waiting for jobs...")
-            # brpop returns tuple (list_name, item)
-            # timeout=0 means block indefinitely
-            # Using try/except for connection errors, but brpop itself blocks.
-            # If redis connection is lost, it might raise ConnectionError.
-
-            # Using timeout=5 to allow loop to check for interrupts or handle signals cleanly if needed,
-            # though here we just loop.
-            val = redis_client.brpop("continuity_jobs", timeout=5)
+            # brpop returns tuple (list_name, item); timeout=5 keeps the loop responsive.
+            val = await redis_client.brpop("continuity_jobs", timeout=5)
             if not val:
                 continue
 
             _, item = val
 
-            logger.info(f"Job received: {item[:50]}...")
+            logger.info("Job received: %.50s...", item)
             data = json.loads(item)
 
-            generate_only(
+            task = asyncio.create_task(generate_only_async(
                 prompt=data["prompt"],
                 path_a=data["path_a"],
                 path_c=data["path_c"],
@@ -235,11 +622,18 @@ def run_worker():
                 guidance=data["guidance"],
                 motion=data["motion"],
                 user_id=data["user_id"]
-            )
+            ))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+            started = True
 
         except Exception as e:
             logger.error(f"Worker Error: {e}")
-            time.sleep(1)
+            await asyncio.sleep(1)
+        finally:
+            if not started:
+                slots.release()
 
 if __name__ == "__main__":
     run_worker()
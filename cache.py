@@ -0,0 +1,131 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+import logging
+import tempfile
+from config import Settings
+
+logger = logging.getLogger(__name__)
+
+
+def _blake2b_128():
+    return hashlib.blake2b(digest_size=16)
+
+
+# (st_dev, st_ino, st_size, st_mtime_ns) -> digest, so an unchanged file is never re-read.
+# Backed by the on-disk `file_hashes` cache (below) so the memo also survives restarts.
+STAT_MEMO_SIZE = 1024
+_stat_hashes = {}
+
+
+def hash_file(filepath):
+    """128-bit BLAKE2b content fingerprint, memoized on the file's stat identity."""
+    with open(filepath, "rb", buffering=0) as f:
+        st = os.fstat(f.fileno())
+        stat_key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        digest = _stat_hashes.get(stat_key)
+        if digest is None:
+            disk_key = hash_key(*stat_key)
+            persisted = file_hashes.get(disk_key)
+            digest = persisted.get("digest") if isinstance(persisted, dict) else None
+            if digest is None:
+                digest = _digest_file(f)
+                file_hashes.set(disk_key, {"digest": digest})
+            if len(_stat_hashes) >= STAT_MEMO_SIZE:
+                _stat_hashes.pop(next(iter(_stat_hashes)), None)
+            _stat_hashes[stat_key] = digest
+        return digest
+
+
+def _digest_file(f):
+    """Uses hashlib.file_digest (3.11+), which runs the read/update loop in C; older
+    runtimes (the 3.10 Docker image) hash a read-only mmap in a single update() call.
+    """
+    if hasattr(hashlib, "file_digest"):
+        return hashlib.file_digest(f, _blake2b_128).hexdigest()
+    h = _blake2b_128()
+    if os.fstat(f.fileno()).st_size:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            h.update(mm)
+    return h.hexdigest()
+
+
+def hash_key(*parts):
+    """Combines string parts into a fixed-length cache key."""
+    return hashlib.blake2b("\x1f".join(map(str, parts)).encode(), digest_size=16).hexdigest()
+
+
+# Seconds between expired-entry sweeps of a JsonCache namespace (per process).
+SWEEP_INTERVAL = 3600
+
+
+class JsonCache:
+    """Small on-disk cache: one JSON document per key under Settings.CACHE_DIR/<namespace>.
+
+    Entries older than `ttl` seconds are treated as misses. Writes are atomic (tmp + os.replace),
+    so concurrent workers never read a half-written entry. Keys that are never read again
+    (e.g. hashes of deleted clips) are removed by sweep(), run from set() every SWEEP_INTERVAL.
+    """
+
+    def __init__(self, namespace, ttl):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._swept_at = None
+
+    @property
+    def directory(self):
+        return os.path.join(Settings.CACHE_DIR, self.namespace)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp, self._path(key))
+        except (OSError, TypeError) as e:
+            logger.warning("Cache write failed (%s/%s): %s", self.namespace, key, e)
+        now = time.monotonic()
+        if self._swept_at is None or now - self._swept_at >= SWEEP_INTERVAL:
+            self._swept_at = now
+            self.sweep()
+
+    def sweep(self):
+        """Deletes entries (and stray .tmp files) older than ttl; returns how many were removed."""
+        removed = 0
+        cutoff = time.time() - self.ttl
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info("Swept %d expired entries from cache/%s", removed, self.namespace)
+        return removed
+
+
+file_hashes = JsonCache("file_hashes", ttl=Settings.PROMPT_CACHE_TTL)
@@ -18,6 +18,11 @@ class Settings:
     PRICE_PER_CREDIT = 100 # cents, example value
     COST_PER_JOB = 10 # credits
     BASE_URL = os.getenv("BASE_URL", "http://localhost:7860")
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY") or 4) # generation jobs per worker process
+    CACHE_DIR = os.getenv("CACHE_DIR") or os.path.join(".cache", "continuity")
+    PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL") or 7 * 24 * 3600) # seconds
+    MEDIA_TMP_DIR = os.getenv("MEDIA_TMP_DIR") or None # e.g. /dev/shm to keep intermediate clips in RAM
+    FILE_UPLOAD_TIMEOUT = int(os.getenv("FILE_UPLOAD_TIMEOUT") or 180) # seconds an uploaded file may stay PROCESSING
 
     @classmethod
     def setup_auth(cls):
@@ -0,0 +1,244 @@
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE = 2  # seconds
+RETRY_CAP = 60  # seconds
+
+_DURATION_RE = re.compile(r"^\s*([\d.]+)s?\s*$")
+
+
+def is_retryable(exc, idempotent=True):
+    """True for rate limits (429 / RESOURCE_EXHAUSTED), connection failures, transient 5xx errors and timeouts.
+
+    With idempotent=False (e.g. starting a Veo render) only errors proving the request was not
+    accepted count: a timeout or 5xx may follow a server-side start, and resubmitting bills twice.
+    """
+    if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    code = getattr(exc, "code", None)
+    if code == 429 or "RESOURCE_EXHAUSTED" in str(exc):
+        return True
+    if not idempotent:
+        return False
+    # asyncio.TimeoutError (raised by wait_for) only aliases TimeoutError from 3.11 on.
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException)):
+        return True
+    return isinstance(code, int) and 500 <= code < 600
+
+
+# Project-wide 403 reasons; a 403 about one resource (e.g. an expired File) is an ordinary error.
+_FATAL_REASONS = ("API_KEY_INVALID", "API key not valid", "SERVICE_DISABLED", "BILLING_DISABLED")
+
+
+def is_fatal(exc):
+    """True for credential/project failures that will not fix themselves (401, invalid key, API or billing disabled)."""
+    code = getattr(exc, "code", None)
+    if code == 401:
+        return True
+    text = str(exc)
+    return code in (400, 403) and any(reason in text for reason in _FATAL_REASONS)
+
+
+def retry_after(exc):
+    """Extracts the server's suggested wait (seconds) from a Retry-After header or RetryInfo detail."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            value = headers.get("Retry-After")
+            if value is not None:
+                return max(0.0, float(value))
+        except (TypeError, ValueError):
+            pass
+
+    # Gemini reports quota hints as google.rpc.RetryInfo, e.g. {"retryDelay": "34s"}
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", details).get("details", [])
+    if isinstance(details, list):
+        for item in details:
+            if isinstance(item, dict) and "retryDelay" in item:
+                match = _DURATION_RE.match(str(item["retryDelay"]))
+                if match:
+                    return float(match.group(1))
+
+    delay = getattr(exc, "retry_delay", None)  # google.api_core ResourceExhausted
+    if delay is not None:
+        return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+    return None
+
+
+def retry_delay(exc, attempt, base=RETRY_BASE, cap=RETRY_CAP):
+    """Honours the server hint if present, otherwise capped exponential backoff with jitter.
+
+    Returns None when the hint exceeds `cap`: sleeping that long would only pin the caller's slot.
+    """
+    hinted = retry_after(exc)
+    if hinted is not None:
+        return hinted if hinted <= cap else None
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose breaker is open."""
+
+
+class ProviderDisabledError(CircuitOpenError):
+    """Raised for a provider disabled for the process lifetime (bad credentials)."""
+
+
+class CircuitBreaker:
+    """Process-wide breaker keyed by circuit name, "<provider>-<endpoint>" (e.g. "gemini-generate", "veo").
+
+    CLOSED -> OPEN once `threshold` retryable failures land within `window` seconds.
+    OPEN lasts max(Retry-After, cooldown); afterwards a single HALF_OPEN probe is let
+    through, which closes the breaker on success or re-opens it on failure.
+    disable() switches off every circuit of a provider until restart.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold=5, window=60.0, cooldown=60.0):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._open_until = {}
+        self._probing = set()
+        self._disabled = {}
+
+    @staticmethod
+    def provider(name):
+        return name.split("-", 1)[0]
+
+    def disabled_reason(self, name):
+        return self._disabled.get(self.provider(name))
+
+    def disable(self, name, reason):
+        with self._lock:
+            provider = self.provider(name)
+            if provider not in self._disabled:
+                logger.error("Provider '%s' disabled for this process: %s", provider, reason)
+            self._disabled[provider] = reason
+
+    def state(self, name):
+        with self._lock:
+            return self._state(name, time.monotonic())
+
+    def _state(self, name, now):
+        until = self._open_until.get(name)
+        if until is None:
+            return self.CLOSED
+        return self.OPEN if now < until else self.HALF_OPEN
+
+    def allow(self, name):
+        with self._lock:
+            state = self._state(name, time.monotonic())
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and name not in self._probing:
+                self._probing.add(name)
+                return True
+            return False
+
+    def record_success(self, name):
+        with self._lock:
+            self._failures.pop(name, None)
+            self._open_until.pop(name, None)
+            self._probing.discard(name)
+
+    def record_failure(self, name, exc=None):
+        with self._lock:
+            now = time.monotonic()
+            recent = [t for t in self._failures.get(name, []) if now - t < self.window]
+            recent.append(now)
+            self._failures[name] = recent
+            if name in self._probing or len(recent) >= self.threshold:
+                cooldown = max(retry_after(exc) or 0.0, self.cooldown) if exc else self.cooldown
+                self._open_until[name] = now + cooldown
+                self._probing.discard(name)
+                logger.warning("Circuit '%s' OPEN for %.0fs after %d failures.", name, cooldown, len(recent))
+
+    def reset(self):
+        with self._lock:
+            self._failures.clear()
+            self._open_until.clear()
+            self._probing.clear()
+            self._disabled.clear()
+
+
+breaker = CircuitBreaker()
+
+
+def _before_attempt(circuit):
+    if not circuit:
+        return
+    reason = breaker.disabled_reason(circuit)
+    if reason:
+        raise ProviderDisabledError(f"{breaker.provider(circuit)} disabled: {reason}")
+    if not breaker.allow(circuit):
+        raise CircuitOpenError(f"Circuit open for {circuit}; skipping call.")
+
+
+def _after_failure(circuit, exc):
+    if not circuit:
+        return
+    if is_fatal(exc):
+        breaker.disable(circuit, str(exc))
+    elif is_retryable(exc):
+        breaker.record_failure(circuit, exc)
+    else:
+        # The provider answered (e.g. 400); it is reachable even if this request was bad.
+        breaker.record_success(circuit)
+
+
+async def aretry_call(fn, attempts=RETRY_ATTEMPTS, on_retry=None, circuit=None, idempotent=True):
+    """Awaits fn() (a zero-arg callable returning an awaitable), retrying retryable errors.
+
+    Pass idempotent=False for calls that start server-side work; see is_retryable.
+
+    on_retry(exc, wait) runs in a worker thread before each sleep, since callers use it for
+    blocking job status writes. When `circuit` is given, calls are gated by the shared breaker
+    and outcomes recorded on it.
+    """
+    for attempt in range(attempts):
+        _before_attempt(circuit)
+        try:
+            result = await fn()
+            if circuit: breaker.record_success(circuit)
+            return result
+        except Exception as e:
+            _after_failure(circuit, e)
+            if attempt == attempts - 1 or not is_retryable(e, idempotent):
+                raise
+            wait = retry_delay(e, attempt)
+            if wait is None:
+                # Hinted wait is too long to sleep through; let the breaker or a fallback take over.
+                raise
+            logger.warning("Retryable error (%s). Waiting %.1fs (attempt %d/%d).", e, wait, attempt + 1, attempts)
+            if on_retry: await asyncio.to_thread(on_retry, e, wait)
+            await asyncio.sleep(wait)
+
+
+async def poll_until(fetch, done, delay, cap, factor=2.0, jitter=0.2, timeout=None):
+    """Awaits fetch() until done(result), sleeping `delay` seconds (x factor per round, capped, +/- jitter) between polls.
+
+    The first fetch is immediate. Raises TimeoutError rather than sleep past `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    result = await fetch()
+    while not done(result):
+        if deadline is not None and time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Polling exceeded {timeout}s.")
+        await asyncio.sleep(delay * random.uniform(1 - jitter, 1 + jitter))
+        delay = min(cap, delay * factor)
+        result = await fetch()
+    return result
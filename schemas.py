@@ -8,3 +8,8 @@ class VideoInput(BaseModel):
 
 class VideoOutput(BaseModel):
     bridging_video_url: str
+
+class DirectorAnalysis(BaseModel):
+    analysis_a: str
+    analysis_c: str
+    visual_prompt_b: str
@@ -16,7 +16,7 @@ import uvicorn, os, shutil, uuid, asyncio, logging, json, redis
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 from config import Settings
-from agent import analyze_only, generate_only
+from agent import analyze_only_async
 from models import SessionLocal, User, Job, init_db
 from billing import create_checkout_session, process_webhook, reconcile_reservations
 
@@ -96,7 +96,7 @@ def read_root():
     return FileResponse("stitch_continuity_dashboard/code.html")
 
 @app.post("/analyze")
-def analyze_endpoint(
+async def analyze_endpoint(
     video_a: UploadFile = File(...),
     video_c: UploadFile = File(...),
     user: User = Depends(get_current_user),
@@ -104,21 +104,23 @@ def analyze_endpoint(
 ):
     try:
         rid = str(uuid.uuid4())
-
-        # Create Job in DB
-        job = Job(id=rid, user_id=user.id, status="analyzing", progress=0, log="Analysis started...")
-        db.add(job)
-        db.commit()
-
         pa = os.path.join("outputs", f"{rid}_a.mp4")
         pc = os.path.join("outputs", f"{rid}_c.mp4")
-        
-        with open(pa, "wb") as b:
-            shutil.copyfileobj(video_a.file, b)
-        with open(pc, "wb") as b:
-            shutil.copyfileobj(video_c.file, b)
-            
-        res = analyze_only(os.path.abspath(pa), os.path.abspath(pc), job_id=rid)
+
+        # Create Job in DB and persist uploads (blocking I/O, kept off the event loop)
+        def create_job_and_save_inputs():
+            job = Job(id=rid, user_id=user.id, status="analyzing", progress=0, log="Analysis started...")
+            db.add(job)
+            db.commit()
+
+            with open(pa, "wb") as b:
+                shutil.copyfileobj(video_a.file, b)
+            with open(pc, "wb") as b:
+                shutil.copyfileobj(video_c.file, b)
+
+        await run_in_threadpool(create_job_and_save_inputs)
+
+        res = await analyze_only_async(os.path.abspath(pa), os.path.abspath(pc), job_id=rid)
         
         if res.get("status") == "error":
             raise HTTPException(500, res.get("detail"))
@@ -159,7 +161,7 @@ async def generate_endpoint(
 
     await run_in_threadpool(create_job_record)
         
-    # Construct task payload matching generate_only signature
+    # Construct task payload matching generate_only_async signature
     task_payload = {
         "prompt": prompt,
         "path_a": video_a_path,
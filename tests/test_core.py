@@ -1,8 +1,9 @@
 import os
 import sys
 import json
+import asyncio
 import pytest
-from unittest.mock import MagicMock, patch, mock_open, ANY
+from unittest.mock import MagicMock, AsyncMock, patch, mock_open, ANY
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.pool import StaticPool
@@ -18,9 +19,15 @@ if "GOOGLE_API_KEY" not in os.environ:
 # Import server
 from server import app, get_db
 from models import Base, User, Job, Transaction
-from agent import analyze_only, generate_only
+from agent import analyze_only_async, generate_only_async
 from google.oauth2 import id_token
 
+def analyze_only(*args, **kwargs):
+    return asyncio.run(analyze_only_async(*args, **kwargs))
+
+def generate_only(*args, **kwargs):
+    return asyncio.run(generate_only_async(*args, **kwargs))
+
 # Setup In-Memory DB for Tests
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
 engine = create_engine(
@@ -54,10 +61,21 @@ MOCK_ANALYSIS_RESPONSE = {
     "visual_prompt_b": "Morph A to C"
 }
 
+def mock_stream(*texts):
+    async def chunks():
+        for text in texts:
+            yield MagicMock(text=text)
+    return AsyncMock(return_value=chunks())
+
 @pytest.fixture
 def mock_genai_client():
+    import agent
+    agent._gemini_client.cache_clear()
+    agent._vertex_client.cache_clear()
     with patch("agent.genai.Client") as mock:
         yield mock
+    agent._gemini_client.cache_clear()
+    agent._vertex_client.cache_clear()
 
 @pytest.fixture
 def mock_stitch():
@@ -110,6 +128,27 @@ def patch_models_session():
          patch("billing.SessionLocal", side_effect=TestingSessionLocal):
              yield
 
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path):
+    with patch("config.Settings.CACHE_DIR", str(tmp_path / "cache")):
+        yield
+
+@pytest.fixture(autouse=True)
+def clear_job_status_memo():
+    import utils
+    utils._last_job_status.clear()
+    yield
+    utils._last_job_status.clear()
+
+@pytest.fixture(autouse=True)
+def clear_upload_handles():
+    import agent
+    agent._upload_handles.clear()
+    agent.remote_files.clear()
+    yield
+    agent._upload_handles.clear()
+    agent.remote_files.clear()
+
 @pytest.fixture(autouse=True)
 def mock_settings():
     with patch("billing.Settings.STRIPE_SECRET_KEY", "sk_test_mock"), \
@@ -122,7 +161,7 @@ def test_read_root():
     response = client.get("/")
     assert response.status_code == 200
 
-@patch("server.analyze_only")
+@patch("server.analyze_only_async", new_callable=AsyncMock)
 def test_analyze_endpoint(mock_analyze, mock_verify_token):
     mock_analyze.return_value = {
         "analysis_a": "desc A",
@@ -201,6 +240,31 @@ def test_get_status_not_found():
     response = client.get("/status/nonexistent")
     assert response.status_code == 404
 
+def test_update_job_status_skips_identical_writes():
+    from utils import update_job_status
+
+    with patch("utils.SessionLocal", side_effect=TestingSessionLocal) as mock_session:
+        update_job_status("job_dedupe", "generating", 50, "Rendering...")
+        update_job_status("job_dedupe", "generating", 50, "Rendering...")
+        assert mock_session.call_count == 1
+
+        update_job_status("job_dedupe", "generating", 60, "Rendering...")
+        assert mock_session.call_count == 2
+
+    response = client.get("/status/job_dedupe")
+    assert response.json()["progress"] == 60
+
+def test_update_job_status_memo_is_bounded():
+    import utils
+
+    with patch("utils.JOB_STATUS_MEMO_SIZE", 2):
+        for job_id in ("job_1", "job_2", "job_3"):
+            utils.update_job_status(job_id, "analyzing", 10, "Checking...")
+        utils.update_job_status("job_2", "analyzing", 20, "Drafting...")
+        utils.update_job_status("job_4", "analyzing", 10, "Checking...")
+
+    assert list(utils._last_job_status) == ["job_2", "job_4"]
+
 def test_license_compliance():
     assert os.path.exists("LICENSE"), "LICENSE file missing"
     with open("LICENSE", "r") as f:
@@ -335,7 +399,7 @@ def test_generate_refund_on_failure(mock_genai_client):
     db.close()
 
     # Mock GenAI to raise exception
-    mock_genai_client.return_value.models.generate_videos.side_effect = Exception("Veo Error")
+    mock_genai_client.return_value.aio.models.generate_videos = AsyncMock(side_effect=Exception("Veo Error"))
 
     with patch("agent.Settings.GCP_PROJECT_ID", "dummy"):
         # Pass user_id
@@ -364,21 +428,180 @@ def test_analyze_only(mock_genai_client, mock_update_status, mock_sleep):
     mock_file = MagicMock()
     mock_file.state.name = "ACTIVE"
     mock_file.name = "file_name"
-    client_instance.files.upload.return_value = mock_file
-    client_instance.files.list.return_value = []
-    client_instance.files.get.return_value = mock_file
+    client_instance.aio.files.upload = AsyncMock(return_value=mock_file)
+    client_instance.aio.files.list = AsyncMock(return_value=MagicMock())
+    client_instance.aio.files.get = AsyncMock(return_value=mock_file)
 
-    # Mock generate_content
-    mock_response = MagicMock()
-    mock_response.text = json.dumps([MOCK_ANALYSIS_RESPONSE])
-    client_instance.models.generate_content.return_value = mock_response
+    # Mock generate_content_stream (response split across chunks)
+    body = json.dumps(MOCK_ANALYSIS_RESPONSE)
+    client_instance.aio.models.generate_content_stream = mock_stream(body[:10], body[10:])
 
-    with patch("agent.get_file_hash", return_value="dummy_hash"):
+    with patch("agent.hash_file", side_effect=["hash_a", "hash_c"]), \
+         patch("agent.os.path.getsize", return_value=50 * 1024 * 1024):
         result = analyze_only("path/a.mp4", "path/c.mp4", job_id="test_id")
 
     assert result["status"] == "success"
     assert result["analysis_a"] == "A video"
     assert mock_update_status.call_count >= 1
+    mock_update_status.assert_any_call("test_id", "analyzing", 35, "Director writing (10 chars)...")
+    assert client_instance.aio.files.upload.call_count == 2
+
+def test_analyze_only_inlines_small_videos(tmp_path, mock_genai_client, mock_update_status):
+    client_instance = mock_genai_client.return_value
+    client_instance.aio.files.upload = AsyncMock()
+
+    client_instance.aio.models.generate_content_stream = mock_stream(json.dumps(MOCK_ANALYSIS_RESPONSE))
+
+    path_a, path_c = tmp_path / "a.mp4", tmp_path / "c.mp4"
+    path_a.write_bytes(MOCK_VIDEO_CONTENT)
+    path_c.write_bytes(MOCK_VIDEO_CONTENT)
+
+    result = analyze_only(str(path_a), str(path_c), job_id="test_id")
+
+    assert result["status"] == "success"
+    assert result["prompt"] == "Morph A to C"
+    client_instance.aio.files.upload.assert_not_called()
+    contents = client_instance.aio.models.generate_content_stream.call_args.kwargs["contents"]
+    assert contents[1].inline_data.data == MOCK_VIDEO_CONTENT
+
+def test_inline_size_accounts_for_base64(tmp_path):
+    from agent import inline_request_size, INLINE_REQUEST_LIMIT
+
+    path_a, path_c = tmp_path / "a.mp4", tmp_path / "c.mp4"
+    for path, size in ((path_a, 8 << 20), (path_c, 7 << 20)):
+        path.touch()
+        os.truncate(path, size)  # 15 MiB raw, ~21 MB once base64-encoded
+
+    assert inline_request_size(str(path_a), str(path_c)) > INLINE_REQUEST_LIMIT
+    os.truncate(path_c, 4 << 20)
+    assert inline_request_size(str(path_a), str(path_c)) <= INLINE_REQUEST_LIMIT
+
+def test_upload_handle_reused_for_same_file():
+    import asyncio
+    from agent import get_or_upload_file
+
+    mock_file = MagicMock()
+    client_instance = MagicMock()
+    client_instance.aio.files.list = AsyncMock(side_effect=Exception("list unavailable"))
+    client_instance.aio.files.upload = AsyncMock(return_value=mock_file)
+
+    with patch("agent.hash_file", return_value="same_hash"):
+        first = asyncio.run(get_or_upload_file(client_instance, "path/a.mp4"))
+        second = asyncio.run(get_or_upload_file(client_instance, "path/a.mp4"))
+
+    assert first is second is mock_file
+    assert client_instance.aio.files.upload.call_count == 1
+    assert client_instance.aio.files.list.call_count == 1
+
+def test_remote_file_listing_shared_within_ttl():
+    import asyncio
+    from agent import get_or_upload_file
+
+    def listed(*names):
+        async def pager():
+            for name in names:
+                f = MagicMock(display_name=name)
+                f.state.name = "ACTIVE"
+                yield f
+        return pager()
+
+    client_instance = MagicMock()
+    client_instance.aio.files.list = AsyncMock(side_effect=lambda **kwargs: listed("hash_a", "hash_c"))
+    client_instance.aio.files.upload = AsyncMock()
+
+    async def both():
+        return await asyncio.gather(
+            get_or_upload_file(client_instance, "path/a.mp4", "hash_a"),
+            get_or_upload_file(client_instance, "path/c.mp4", "hash_c")
+        )
+    file_a, file_c = asyncio.run(both())
+
+    assert (file_a.display_name, file_c.display_name) == ("hash_a", "hash_c")
+    assert client_instance.aio.files.list.call_count == 1
+    client_instance.aio.files.upload.assert_not_called()
+
+def test_listed_upload_expires_with_the_remote_file():
+    import asyncio
+    import agent
+    from datetime import datetime, timedelta, timezone
+
+    now = datetime.now(timezone.utc)
+    stale = MagicMock(display_name="old_hash", expiration_time=now + timedelta(minutes=30))
+    fresh = MagicMock(display_name="new_hash", expiration_time=now + timedelta(hours=10))
+    stale.state.name = fresh.state.name = "ACTIVE"
+
+    async def pager(**kwargs):
+        async def files():
+            for f in (stale, fresh):
+                yield f
+        return files()
+
+    client_instance = MagicMock()
+    client_instance.aio.files.list = AsyncMock(side_effect=pager)
+    client_instance.aio.files.upload = AsyncMock(return_value=MagicMock())
+
+    assert asyncio.run(agent.get_or_upload_file(client_instance, "path/a.mp4", "new_hash")) is fresh
+    asyncio.run(agent.get_or_upload_file(client_instance, "path/b.mp4", "old_hash"))
+
+    client_instance.aio.files.upload.assert_awaited_once()
+    expires_at = agent._upload_handles["new_hash"][0]
+    assert expires_at == pytest.approx((fresh.expiration_time - timedelta(hours=1)).timestamp())
+
+def test_upload_index_survives_process_restart():
+    import asyncio
+    import agent
+
+    uploaded, refreshed = MagicMock(), MagicMock()
+    uploaded.name = "files/abc"
+    refreshed.state.name = "ACTIVE"
+    client_instance = MagicMock()
+    client_instance.aio.files.list = AsyncMock(side_effect=Exception("list unavailable"))
+    client_instance.aio.files.upload = AsyncMock(return_value=uploaded)
+    client_instance.aio.files.get = AsyncMock(return_value=refreshed)
+
+    asyncio.run(agent.get_or_upload_file(client_instance, "path/a.mp4", "same_hash"))
+    agent._upload_handles.clear()  # simulate a new worker process
+    result = asyncio.run(agent.get_or_upload_file(client_instance, "path/a.mp4", "same_hash"))
+
+    assert result is refreshed
+    client_instance.aio.files.get.assert_awaited_once_with(name="files/abc")
+    assert client_instance.aio.files.upload.call_count == 1
+    assert client_instance.aio.files.list.call_count == 1
+
+def test_hash_file_skips_rehash_of_unchanged_file(tmp_path):
+    import cache
+
+    path = tmp_path / "a.mp4"
+    path.write_bytes(MOCK_VIDEO_CONTENT)
+
+    with patch("cache._digest_file", wraps=cache._digest_file) as mock_digest:
+        first = cache.hash_file(str(path))
+        assert cache.hash_file(str(path)) == first
+        assert mock_digest.call_count == 1
+
+        path.write_bytes(b"other video content")
+        second = cache.hash_file(str(path))
+        assert second != first
+        assert mock_digest.call_count == 2
+
+        cache._stat_hashes.clear()  # simulate a restart: the on-disk memo still applies
+        assert cache.hash_file(str(path)) == second
+        assert mock_digest.call_count == 2
+
+def test_json_cache_sweeps_expired_entries():
+    import time
+    from cache import JsonCache
+
+    store = JsonCache("sweep_test", ttl=60)
+    store.set("old", {"v": 1})
+    old = time.time() - 120
+    os.utime(store._path("old"), (old, old))
+
+    store._swept_at = None  # due for a sweep on the next write
+    store.set("new", {"v": 2})
+
+    assert not os.path.exists(store._path("old"))
+    assert store.get("new") == {"v": 2}
 
 def test_generate_only(mock_genai_client, mock_stitch, mock_update_status, mock_sleep):
     # Setup User for reservation
@@ -396,7 +619,7 @@ def test_generate_only(mock_genai_client, mock_stitch, mock_update_status, mock_
         # Mock generate_videos
         mock_op = MagicMock()
         mock_op.name = "operation_name"
-        client_instance.models.generate_videos.return_value = mock_op
+        client_instance.aio.models.generate_videos = AsyncMock(return_value=mock_op)
 
         # Mock operations.get (polling)
         mock_refreshed_op = MagicMock()
@@ -408,7 +631,7 @@ def test_generate_only(mock_genai_client, mock_stitch, mock_update_status, mock_
         mock_video_result.generated_videos[0].video.uri = "gs://bucket/video.mp4"
 
         mock_refreshed_op.result = mock_video_result
-        client_instance.operations.get.return_value = mock_refreshed_op
+        client_instance.aio.operations.get = AsyncMock(return_value=mock_refreshed_op)
 
         with patch("agent.download_blob"), \
              patch("agent.Settings.GCP_PROJECT_ID", "dummy_project"), \
@@ -438,3 +661,124 @@ def test_generate_only(mock_genai_client, mock_stitch, mock_update_status, mock_
                      txn = db.query(Transaction).filter(Transaction.user_id == user_id, Transaction.type == "reserve").first()
                      assert txn.status == "settled"
                      db.close()
+
+def test_wait_for_operation_backs_off_until_done():
+    import asyncio
+    from agent import wait_for_operation
+
+    pending, done = MagicMock(done=False), MagicMock(done=True)
+    client_instance = MagicMock()
+    client_instance.aio.operations.get = AsyncMock(side_effect=[pending, pending, pending, done])
+
+    with patch("agent.asyncio.sleep", new_callable=AsyncMock) as mock_async_sleep, \
+         patch("resilience.random.uniform", return_value=1.0):
+        result = asyncio.run(wait_for_operation(client_instance, "operations/veo-1"))
+
+    assert result is done
+    assert [c.args[0] for c in mock_async_sleep.call_args_list] == [2.0, 4.0, 8.0]
+
+def test_wait_active_checks_immediately_before_backing_off():
+    import asyncio
+    from agent import wait_active
+
+    processing = MagicMock(); processing.state.name = "PROCESSING"
+    active = MagicMock(); active.state.name = "ACTIVE"
+    client_instance = MagicMock()
+    client_instance.aio.files.get = AsyncMock(side_effect=[active])
+
+    with patch("agent.asyncio.sleep", new_callable=AsyncMock) as mock_async_sleep:
+        result = asyncio.run(wait_active(client_instance, processing))
+
+    assert result is active
+    mock_async_sleep.assert_not_called()
+
+def test_analyze_only_reuses_cached_prompt(tmp_path, mock_genai_client, mock_update_status):
+    client_instance = mock_genai_client.return_value
+    client_instance.aio.models.generate_content_stream = mock_stream(json.dumps(MOCK_ANALYSIS_RESPONSE))
+
+    path_a, path_c = tmp_path / "a.mp4", tmp_path / "c.mp4"
+    path_a.write_bytes(b"clip a")
+    path_c.write_bytes(b"clip c")
+
+    first = analyze_only(str(path_a), str(path_c), job_id="job_1")
+    second = analyze_only(str(path_a), str(path_c), job_id="job_2")
+
+    assert first == second
+    assert second["prompt"] == "Morph A to C"
+    assert client_instance.aio.models.generate_content_stream.call_count == 1
+
+def test_analyze_only_salvages_truncated_response(tmp_path, mock_genai_client, mock_update_status):
+    client_instance = mock_genai_client.return_value
+    truncated = json.dumps(MOCK_ANALYSIS_RESPONSE)[:-7]  # cut inside visual_prompt_b
+    client_instance.aio.models.generate_content_stream = mock_stream(truncated)
+
+    path_a, path_c = tmp_path / "a.mp4", tmp_path / "c.mp4"
+    path_a.write_bytes(b"clip a")
+    path_c.write_bytes(b"clip c")
+
+    with patch("agent.prompt_cache.set") as mock_cache_set:
+        result = analyze_only(str(path_a), str(path_c), job_id="test_id")
+
+    assert result["status"] == "success"
+    assert result["analysis_a"] == "A video"
+    assert result["prompt"] == "Morph A"
+    mock_cache_set.assert_not_called()
+
+def test_director_falls_back_to_next_model_when_rate_limited(tmp_path, mock_genai_client, mock_update_status):
+    from resilience import breaker
+    breaker.reset()
+
+    class RateLimited(Exception):
+        code = 429
+
+    async def chunks():
+        yield MagicMock(text=json.dumps(MOCK_ANALYSIS_RESPONSE))
+
+    async def generate(model, **kwargs):
+        if model == "gemini-2.0-flash":
+            raise RateLimited("429 RESOURCE_EXHAUSTED")
+        return chunks()
+
+    client_instance = mock_genai_client.return_value
+    client_instance.aio.models.generate_content_stream = AsyncMock(side_effect=generate)
+
+    path_a, path_c = tmp_path / "a.mp4", tmp_path / "c.mp4"
+    path_a.write_bytes(b"clip a")
+    path_c.write_bytes(b"clip c")
+
+    result = analyze_only(str(path_a), str(path_c), job_id="test_id")
+
+    assert result["prompt"] == "Morph A to C"
+    models = [c.kwargs["model"] for c in client_instance.aio.models.generate_content_stream.call_args_list]
+    assert models == ["gemini-2.0-flash", "gemini-2.0-flash-lite"]
+    # The lite answer is not cached: the next request tries the primary model again
+    analyze_only(str(path_a), str(path_c), job_id="test_id_2")
+    assert client_instance.aio.models.generate_content_stream.call_count == 4
+    breaker.reset()
+
+def test_concurrent_identical_analyses_share_one_call(tmp_path, mock_genai_client, mock_update_status):
+    import asyncio
+
+    async def slow_stream(**kwargs):
+        async def chunks():
+            await asyncio.sleep(0.05)
+            yield MagicMock(text=json.dumps(MOCK_ANALYSIS_RESPONSE))
+        return chunks()
+
+    client_instance = mock_genai_client.return_value
+    client_instance.aio.models.generate_content_stream = AsyncMock(side_effect=slow_stream)
+
+    path_a, path_c = tmp_path / "a.mp4", tmp_path / "c.mp4"
+    path_a.write_bytes(b"clip a")
+    path_c.write_bytes(b"clip c")
+
+    async def run_both():
+        return await asyncio.gather(
+            analyze_only_async(str(path_a), str(path_c), job_id="job_1"),
+            analyze_only_async(str(path_a), str(path_c), job_id="job_2")
+        )
+
+    first, second = asyncio.run(run_both())
+    assert first == second
+    assert first["status"] == "success"
+    assert client_instance.aio.models.generate_content_stream.call_count == 1
@@ -1,7 +1,8 @@
 import os
 import sys
+import asyncio
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.pool import StaticPool
@@ -18,6 +19,7 @@ if "GOOGLE_API_KEY" not in os.environ:
 from server import app, get_db
 from models import Base, User, Transaction
 from billing import reconcile_reservations
+from resilience import retry_delay, aretry_call, poll_until, CircuitBreaker, CircuitOpenError, ProviderDisabledError, breaker
 
 # Setup In-Memory DB
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -160,3 +162,237 @@ def test_jwt_issuer_enforcement():
         # Should be 401 or 403. Server code raises ValueError which is caught in get_current_user...
         # Wait, get_current_user catches ValueError and raises 401.
         assert response.status_code == 401
+
+class _RateLimited(Exception):
+    code = 429
+
+    def __init__(self, headers=None, details=None):
+        super().__init__("429 RESOURCE_EXHAUSTED")
+        self.response = MagicMock(headers=headers or {})
+        self.details = details
+
+def test_retry_delay_honours_retry_after_header():
+    assert retry_delay(_RateLimited(headers={"Retry-After": "7"}), attempt=0) == 7.0
+
+def test_retry_delay_honours_retry_info():
+    details = {"error": {"details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "34s"}]}}
+    assert retry_delay(_RateLimited(details=details), attempt=2) == 34.0
+
+def test_aretry_call_gives_up_on_hint_beyond_cap():
+    fn = AsyncMock(side_effect=_RateLimited(headers={"Retry-After": "3600"}))
+    assert retry_delay(fn.side_effect, attempt=0) is None
+    with patch("resilience.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+        with pytest.raises(_RateLimited):
+            _retry(fn)
+    assert fn.call_count == 1
+    mock_sleep.assert_not_called()
+
+def test_retry_delay_exponential_backoff_is_capped():
+    for attempt in range(10):
+        wait = retry_delay(_RateLimited(), attempt)
+        assert 0 < wait <= 60 * 1.5
+
+def _retry(fn, **kwargs):
+    return asyncio.run(aretry_call(fn, **kwargs))
+
+def test_aretry_call_retries_rate_limits_only():
+    fn = AsyncMock(side_effect=[_RateLimited(headers={"Retry-After": "0"}), "ok"])
+    assert _retry(fn) == "ok"
+    assert fn.call_count == 2
+
+    fn = AsyncMock(side_effect=ValueError("bad request"))
+    with pytest.raises(ValueError):
+        _retry(fn)
+    assert fn.call_count == 1
+
+def test_circuit_breaker_opens_and_half_opens():
+    cb = CircuitBreaker(threshold=2, window=60, cooldown=30)
+    with patch("resilience.time.monotonic", return_value=100.0):
+        assert cb.allow("veo")
+        cb.record_failure("veo")
+        assert cb.state("veo") == CircuitBreaker.CLOSED
+        cb.record_failure("veo", _RateLimited(headers={"Retry-After": "90"}))
+        assert cb.state("veo") == CircuitBreaker.OPEN
+        assert not cb.allow("veo")
+
+    # Cooldown honours the larger Retry-After hint, then admits exactly one probe
+    with patch("resilience.time.monotonic", return_value=150.0):
+        assert not cb.allow("veo")
+    with patch("resilience.time.monotonic", return_value=191.0):
+        assert cb.allow("veo")
+        assert not cb.allow("veo")
+        cb.record_success("veo")
+        assert cb.state("veo") == CircuitBreaker.CLOSED
+
+def test_aretry_call_skips_open_circuit():
+    breaker.reset()
+    fn = AsyncMock(side_effect=_RateLimited(headers={"Retry-After": "0"}))
+    try:
+        for _ in range(breaker.threshold):
+            with pytest.raises((_RateLimited, CircuitOpenError)):
+                _retry(fn, attempts=1, circuit="gemini-generate")
+        calls = fn.call_count
+        with pytest.raises(CircuitOpenError):
+            _retry(fn, circuit="gemini-generate")
+        assert fn.call_count == calls
+    finally:
+        breaker.reset()
+
+def test_auth_failure_disables_provider_for_all_endpoints():
+    class _Forbidden(Exception):
+        code = 403
+
+    breaker.reset()
+    fn = AsyncMock(side_effect=_Forbidden("403 PERMISSION_DENIED. reason: SERVICE_DISABLED"))
+    try:
+        with pytest.raises(_Forbidden):
+            _retry(fn, circuit="gemini-files")
+        with pytest.raises(ProviderDisabledError):
+            _retry(fn, circuit="gemini-generate")
+        assert fn.call_count == 1
+    finally:
+        breaker.reset()
+
+def test_forbidden_file_does_not_disable_provider():
+    class _Forbidden(Exception):
+        code = 403
+
+    breaker.reset()
+    fn = AsyncMock(side_effect=_Forbidden("403 PERMISSION_DENIED. You do not have permission to access the File abc or it may not exist."))
+    try:
+        for _ in range(2):
+            with pytest.raises(_Forbidden):
+                _retry(fn, circuit="gemini-generate")
+        assert fn.call_count == 2
+        assert breaker.disabled_reason("gemini-files") is None
+    finally:
+        breaker.reset()
+
+def test_wait_for_timeout_is_retried_and_counted_by_breaker():
+    breaker.reset()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return asyncio.wait_for(asyncio.Event().wait(), 0.01)
+
+    try:
+        with patch("resilience.retry_delay", return_value=0):
+            with pytest.raises(asyncio.TimeoutError):
+                _retry(fn, attempts=2, circuit="gemini-generate")
+        assert len(calls) == 2
+        assert len(breaker._failures["gemini-generate"]) == 2
+    finally:
+        breaker.reset()
+
+def test_non_idempotent_call_is_not_resubmitted_after_timeout():
+    import httpx
+
+    fn = AsyncMock(side_effect=[httpx.ReadTimeout("read timed out"), "op"])
+    with pytest.raises(httpx.ReadTimeout):
+        _retry(fn, idempotent=False)
+    assert fn.call_count == 1
+
+    fn = AsyncMock(side_effect=[_RateLimited(headers={"Retry-After": "0"}), httpx.ConnectError("refused"), "op"])
+    with patch("resilience.retry_delay", return_value=0):
+        assert _retry(fn, idempotent=False) == "op"
+    assert fn.call_count == 3
+
+def test_download_to_temp_reuses_file_on_304():
+    import io
+    import utils
+
+    first = MagicMock(status_code=200, headers={"ETag": '"v1"'}, raw=io.BytesIO(b"video bytes"))
+    second = MagicMock(status_code=304, headers={})
+    url = "https://example.com/clip.mp4"
+
+    with patch.dict(utils._DOWNLOAD_CACHE, clear=True), \
+         patch.object(utils._HTTP_SESSION, "get", side_effect=[first, second]) as mock_get:
+        path = utils.download_to_temp(url + "?X-Goog-Expires=900&X-Goog-Signature=aa")
+        again = utils.download_to_temp(url + "?X-Goog-Expires=900&X-Goog-Signature=bb")
+
+    assert again == path
+    assert mock_get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+    with open(path, "rb") as f:
+        assert f.read() == b"video bytes"
+    os.remove(path)
+
+def test_download_cache_key_keeps_resource_query_params():
+    import utils
+
+    signed = utils.download_cache_key("https://h/o.mp4?X-Goog-Signature=ab&X-Amz-Date=1&Expires=2&Signature=s")
+    assert signed == "https://h/o.mp4"
+    assert utils.download_cache_key("https://h/download?id=1") != utils.download_cache_key("https://h/download?id=2")
+
+def test_download_to_temp_resolves_local_sources_without_copy(tmp_path):
+    from pathlib import Path
+    import utils
+
+    clip = tmp_path / "my clip.mp4"
+    clip.write_bytes(b"x")
+
+    with patch.object(utils._HTTP_SESSION, "get") as mock_get, \
+         patch("utils.download_blob") as mock_blob:
+        assert utils.download_to_temp(Path(clip)) == str(clip)
+        assert utils.download_to_temp(clip.as_uri()) == str(clip)
+        path = utils.download_to_temp("gs://bucket/a/b.mp4")
+
+    mock_get.assert_not_called()
+    mock_blob.assert_called_once_with("gs://bucket/a/b.mp4", path)
+    assert path.endswith(".mp4")
+    os.remove(path)
+
+def test_poll_until_times_out_instead_of_oversleeping():
+    fetch = AsyncMock(return_value="PENDING")
+
+    with patch("resilience.asyncio.sleep", new_callable=AsyncMock) as mock_sleep, \
+         patch("resilience.time") as mock_time:
+        mock_time.monotonic.side_effect = [0.0, 0.0, 2.0, 6.0]
+        with pytest.raises(TimeoutError):
+            asyncio.run(poll_until(fetch, lambda r: r == "DONE", delay=2.0, cap=30.0, jitter=0, timeout=10))
+
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [2.0, 4.0]
+
+def test_stitch_stream_copies_compatible_inputs():
+    import utils
+
+    with patch("utils.shutil.which", return_value="/usr/bin/ffmpeg"), \
+         patch("utils.probe_streams", return_value=((("codec_name", "h264"),),)), \
+         patch("utils.normalize_video") as mock_normalize, \
+         patch("utils.run_ffmpeg") as mock_ffmpeg:
+        result = utils.stitch_videos("/in/a.mp4", "/in/b.mp4", "/in/c.mp4", "out.mp4", normalized={"/in/a.mp4": "/tmp/a_norm.mp4"})
+
+    assert result == "out.mp4"
+    mock_normalize.assert_not_called()
+    concat_list = mock_ffmpeg.call_args.kwargs["input"].decode()
+    assert concat_list == "file '/in/a.mp4'\nfile '/in/b.mp4'\nfile '/in/c.mp4'\n"
+
+def test_normalize_video_gives_each_call_its_own_output():
+    import utils
+
+    with patch("utils.shutil.which", return_value="/usr/bin/ffmpeg"), \
+         patch("utils.run_ffmpeg") as mock_ffmpeg:
+        first = utils.normalize_video("outputs/job_a.mp4")
+        second = utils.normalize_video("outputs/job_a.mp4")
+
+    assert first != second
+    assert not first.startswith("outputs")
+    assert mock_ffmpeg.call_args.args[0][-1] == second
+    os.remove(first)
+    os.remove(second)
+
+def test_stitch_renormalizes_missing_prepared_input(tmp_path):
+    import utils
+
+    kept = tmp_path / "a_norm.mp4"
+    kept.write_bytes(b"x")
+    normalized = {"/in/a.mp4": str(kept), "/in/c.mp4": str(tmp_path / "gone.mp4")}
+
+    with patch("utils.shutil.which", return_value="/usr/bin/ffmpeg"), \
+         patch("utils.can_stream_copy", return_value=False), \
+         patch("utils.normalize_video", side_effect=lambda p: p + ".norm") as mock_normalize, \
+         patch("utils.run_ffmpeg"):
+        result = utils.stitch_videos("/in/a.mp4", "/in/b.mp4", "/in/c.mp4", "out.mp4", normalized=normalized)
+
+    assert result == "out.mp4"
+    assert [c.args[0] for c in mock_normalize.call_args_list] == ["/in/b.mp4", "/in/c.mp4"]
@@ -1,29 +1,136 @@
 import os
+import json
+import queue
 import shutil
 import requests
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import tempfile
 import logging
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
 from sqlalchemy.orm.exc import StaleDataError
 from config import Settings
 from models import SessionLocal, Job
 
 logger = logging.getLogger(__name__)
 
+# 1 MiB keeps per-download buffers small while still amortising syscalls.
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Shared keep-alive pool for source downloads; retries transient gateway errors.
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=20, pool_maxsize=100,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+))
+HTTP_TIMEOUT = (10, 120) # (connect, read) seconds
+
+# Reusable copy buffers so concurrent downloads don't allocate a fresh bytes object per chunk.
+_BUFFER_POOL = queue.LifoQueue()
+
+def copy_stream(src, dst):
+    """shutil.copyfileobj equivalent that readinto()s a pooled DOWNLOAD_CHUNK_SIZE buffer."""
+    try:
+        buf = _BUFFER_POOL.get_nowait()
+    except queue.Empty:
+        buf = bytearray(DOWNLOAD_CHUNK_SIZE)
+    view = memoryview(buf)
+    try:
+        while True:
+            n = src.readinto(view)
+            if not n: break
+            dst.write(view[:n])
+    finally:
+        view.release()
+        _BUFFER_POOL.put(buf)
+
+# url (minus signing params, so re-signed URLs share an entry) -> (local_path, validators) of earlier downloads
+_DOWNLOAD_CACHE = {}
+_DOWNLOAD_CACHE_LOCK = threading.Lock()
+
+# GCS/S3 V4 and GCS V2 signed-URL parameters; every other query parameter identifies the resource.
+_SIGNING_PARAM_PREFIXES = ("x-goog-", "x-amz-")
+_SIGNING_PARAMS = {"googleaccessid", "expires", "signature"}
+
+def download_cache_key(url):
+    """url with signed-URL parameters dropped, so re-signing the same object reuses its cache entry."""
+    parts = urlsplit(url)
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not (k.lower().startswith(_SIGNING_PARAM_PREFIXES) or k.lower() in _SIGNING_PARAMS)
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query), fragment=""))
+
+def new_temp_path(suffix=".mp4"):
+    """Creates an empty temp file under Settings.MEDIA_TMP_DIR (system default if unset) and returns its path."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=Settings.MEDIA_TMP_DIR) as f:
+        return f.name
+
 def download_to_temp(url):
+    """Downloads url to a temp file; repeat calls revalidate with ETag/Last-Modified and reuse it on 304.
+
+    Local paths (str or os.PathLike) and file:// URIs are returned as-is without a copy;
+    gs:// objects are fetched with download_blob.
+    """
+    url = os.fspath(url)
+    if url.startswith("file://"): return unquote(urlsplit(url).path)
     if os.path.exists(url): return url
-    resp = requests.get(url, stream=True); resp.raise_for_status()
-    suffix = os.path.splitext(url.split("/")[-1])[1] or ".mp4"
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
-        shutil.copyfileobj(resp.raw, f)
+    if url.startswith("gs://"):
+        path = new_temp_path(os.path.splitext(url)[1] or ".mp4")
+        download_blob(url, path)
+        return path
+    key = download_cache_key(url)
+    with _DOWNLOAD_CACHE_LOCK:
+        cached = _DOWNLOAD_CACHE.get(key)
+    headers = {}
+    if cached and os.path.exists(cached[0]):
+        etag, last_modified = cached[1]
+        if etag: headers["If-None-Match"] = etag
+        if last_modified: headers["If-Modified-Since"] = last_modified
+
+    resp = _HTTP_SESSION.get(url, stream=True, timeout=HTTP_TIMEOUT, headers=headers)
+    if resp.status_code == 304 and headers:
+        resp.close()
+        logger.info("♻️ Download Cache Hit: %s", key)
+        return cached[0]
+    resp.raise_for_status()
+    suffix = os.path.splitext(urlsplit(url).path)[1] or ".mp4"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=Settings.MEDIA_TMP_DIR) as f:
+        copy_stream(resp.raw, f)
+
+    validators = (resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+    if any(validators):
+        with _DOWNLOAD_CACHE_LOCK:
+            _DOWNLOAD_CACHE[key] = (f.name, validators)
     return f.name
 
+# Objects at least this large are fetched as parallel ranged GETs instead of one stream.
+PARALLEL_DOWNLOAD_THRESHOLD = 64 << 20
+PARALLEL_DOWNLOAD_CHUNK = 32 << 20
+
 def download_blob(gcs_uri, destination_file_name):
+    """Streams a GCS object to disk in one GET instead of buffering it.
+    Large objects are split into concurrent ranged downloads (threads) to use more than one TCP stream.
+    Single-stream downloads are checked with CRC32C (hardware-accelerated via google-crc32c) rather than MD5;
+    chunk_size stays unset because chunked downloads skip checksumming."""
     if not gcs_uri.startswith("gs://"): raise ValueError(f"Invalid GCS URI: {gcs_uri}")
     parts = gcs_uri[5:].split("/", 1)
-    storage.Client().bucket(parts[0]).blob(parts[1]).download_to_filename(destination_file_name)
+    bucket = storage.Client().bucket(parts[0])
+    blob = bucket.get_blob(parts[1]) or bucket.blob(parts[1])
+    if blob.size and blob.size >= PARALLEL_DOWNLOAD_THRESHOLD:
+        transfer_manager.download_chunks_concurrently(
+            blob, destination_file_name, chunk_size=PARALLEL_DOWNLOAD_CHUNK,
+            worker_type=transfer_manager.THREAD, max_workers=8
+        )
+        return
+    with open(destination_file_name, "wb") as f:
+        blob.download_to_file(f, raw_download=True, checksum="crc32c", timeout=HTTP_TIMEOUT)
 
 def upload_to_gcs(local_path, destination_blob_name):
     if not Settings.GCP_BUCKET_NAME: return None
@@ -45,55 +152,93 @@ def get_history_from_gcs():
         return []
 
 def save_video_bytes(bytes_data, suffix=".mp4") -> str:
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=Settings.MEDIA_TMP_DIR) as f:
         f.write(bytes_data)
     return f.name
 
+# Concurrent jobs share the CPU; ffmpeg work runs on this bounded pool rather than asyncio's default
+# executor, so queued encodes cap simultaneous processes without starving DB/network to_thread calls.
+FFMPEG_CONCURRENCY = min(4, os.cpu_count() or 1)
+FFMPEG_EXECUTOR = ThreadPoolExecutor(max_workers=FFMPEG_CONCURRENCY, thread_name_prefix="ffmpeg")
+
+def run_ffmpeg(cmd, **kwargs):
+    """subprocess.run for ffmpeg; async callers submit the enclosing work to FFMPEG_EXECUTOR."""
+    return subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30, **kwargs)
+
+NORMALIZE_FILTER = "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2,setsar=1,fps=24,format=yuv420p"
+NORMALIZE_ARGS = ("-vf", NORMALIZE_FILTER, "-c:v", "libx264", "-preset", "ultrafast", "-crf", "28", "-an")
+
 def normalize_video(input_path):
     """Helper to normalize video. Returns None if ffmpeg missing."""
     if not shutil.which("ffmpeg"): return None
 
-    output_path = input_path.replace(".mp4", "_norm.mp4")
-    cmd = [
-        "ffmpeg", "-y", "-i", input_path,
-        "-vf", "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2,setsar=1,fps=24,format=yuv420p",
-        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "28",
-        "-an",
-        output_path
-    ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+    # Unique per call: concurrent jobs on the same clips must not share (or delete) each other's output
+    output_path = new_temp_path(".mp4")
+    try:
+        run_ffmpeg(["ffmpeg", "-y", "-i", input_path, *NORMALIZE_ARGS, output_path])
+    except BaseException:
+        os.remove(output_path)
+        raise
     return output_path
 
-def stitch_videos(path_a, path_b, path_c, output_path):
-    """ Attempts to stitch videos. RETURNS: output_path if successful, NONE if ffmpeg is missing/fails. """
+PROBE_ENTRIES = "stream=codec_type,codec_name,profile,width,height,pix_fmt,r_frame_rate,time_base,sample_rate,channels"
+
+def probe_streams(path):
+    """Stream parameters that must match for a stream-copy concat. None if ffprobe fails."""
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", PROBE_ENTRIES, "-of", "json", path],
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=15
+        ).stdout
+        streams = json.loads(out).get("streams", [])
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+    return tuple(tuple(sorted(s.items())) for s in streams) or None
+
+def can_stream_copy(*paths):
+    """True when every input has identical stream layout and codec parameters (probed in parallel)."""
+    if not shutil.which("ffprobe"): return False
+    with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+        signatures = list(pool.map(probe_streams, paths))
+    return signatures[0] is not None and all(sig == signatures[0] for sig in signatures)
+
+def stitch_videos(path_a, path_b, path_c, output_path, normalized=None):
+    """ Attempts to stitch videos. RETURNS: output_path if successful, NONE if ffmpeg is missing/fails.
+    normalized: optional {input_path: normalized_path} produced ahead of time by normalize_video. """
     # 1. CHECK IF FFMPEG EXISTS
     if not shutil.which("ffmpeg"):
         logger.warning("⚠️ FFmpeg not found. Skipping stitch.")
         return None
 
-    logger.info(f"🧵 Stitching: {path_a} + {path_b} + {path_c}")
+    logger.info("🧵 Stitching: %s + %s + %s", path_a, path_b, path_c)
     try:
-        norm_a = normalize_video(path_a)
-        norm_b = normalize_video(path_b)
-        norm_c = normalize_video(path_c)
-        
-        if not all([norm_a, norm_b, norm_c]):
-            raise Exception("Normalization failed")
+        if can_stream_copy(path_a, path_b, path_c):
+            # Already concat-compatible: skip the three re-encodes entirely (keeps source audio too)
+            logger.info("🧵 Inputs share codec parameters; concatenating without re-encode.")
+            parts, intermediates = (path_a, path_b, path_c), ()
+        else:
+            normalized = normalized or {}
+            # Re-normalize any pre-normalized input that has since disappeared
+            prepared = lambda p: normalized[p] if os.path.exists(normalized.get(p) or "") else normalize_video(p)
+            norm_a, norm_b, norm_c = prepared(path_a), prepared(path_b), prepared(path_c)
+
+            if not all([norm_a, norm_b, norm_c]):
+                raise Exception("Normalization failed")
+            parts = intermediates = (norm_a, norm_b, norm_c)
         
-        list_file = "concat_list.txt"
-        with open(list_file, "w") as f:
-            f.write(f"file '{norm_a}'\n")
-            f.write(f"file '{norm_b}'\n")
-            f.write(f"file '{norm_c}'\n")
+        # Concat list is piped over stdin: no shared concat_list.txt in CWD for concurrent jobs to clobber
+        concat_list = "".join(f"file '{os.path.abspath(p)}'\n" for p in parts)
         
+        # Stream copy; faststart moves the moov atom up front so browsers can play before the download finishes
         cmd = [
-            "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_file,
-            "-c", "copy", output_path
+            "ffmpeg", "-y", "-fflags", "+genpts", "-f", "concat", "-safe", "0",
+            "-protocol_whitelist", "file,pipe", "-i", "pipe:0",
+            "-c", "copy", "-avoid_negative_ts", "make_zero", "-movflags", "+faststart", output_path
         ]
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+        run_ffmpeg(cmd, input=concat_list.encode())
         
         # Cleanup
-        for p in [norm_a, norm_b, norm_c, list_file]:
+        for p in intermediates:
             if os.path.exists(p): os.remove(p)
             
         return output_path
@@ -102,8 +247,18 @@ def stitch_videos(path_a, path_b, path_c, output_path):
         logger.error(f"Stitch Logic Failed: {e}")
         return None  # Return None so the pipeline continues without crashing
 
+# Last (status, progress, log) this process wrote per job; identical repeats skip the DB round trip.
+# LRU-bounded: /analyze jobs never reach a terminal status in the server process.
+JOB_STATUS_MEMO_SIZE = 1024
+_last_job_status = {}
+_last_job_status_lock = threading.Lock()
+
 def update_job_status(job_id, status, progress, log=None, video_url=None, merged_video_url=None):
     if not job_id: return
+    state = (status, progress, log)
+    if not video_url and not merged_video_url:
+        with _last_job_status_lock:
+            if _last_job_status.get(job_id) == state: return
     os.makedirs("outputs", exist_ok=True)
 
     final_url = video_url
@@ -143,6 +298,12 @@ def update_job_status(job_id, status, progress, log=None, video_url=None, merged
                 if final_url: job.video_url = final_url
                 if final_merged_url: job.merged_video_url = final_merged_url
             db.commit()
+            with _last_job_status_lock:
+                _last_job_status.pop(job_id, None)
+                if status not in ("completed", "error"):
+                    if len(_last_job_status) >= JOB_STATUS_MEMO_SIZE:
+                        _last_job_status.pop(next(iter(_last_job_status)), None)
+                    _last_job_status[job_id] = state
             break
         except StaleDataError:
             logger.warning(f"Optimistic locking failure for job {job_id}. Retrying...")